@@ -9,11 +9,15 @@ from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import numpy as np
+import cv2
 import pickle
 import json
-import io
+import os
 import time
-from PIL import Image
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from pathlib import Path
 
 from preprocessing import ImagePreprocessor
@@ -49,9 +53,74 @@ SVR_MODEL_PATH = MODEL_DIR / "hemolens_svr_model.pkl"  # Backup
 ridge_model = None
 gb_model = None
 scaler = None
+fused_weights = None
+fused_bias = None
 eye_detector = None
 models_loaded = False
 
+# Stateless helpers shared by every request
+FEATURE_EXTRACTOR = FeatureExtractor()
+FEATURE_NAMES = FeatureExtractor.get_feature_names()
+
+# Uploads are read in chunks and rejected as soon as they pass the size cap
+UPLOAD_CHUNK_BYTES = 1 << 20
+MAX_UPLOAD_BYTES = 8 << 20
+
+# Successful /predict responses keyed by a hash of the uploaded bytes, so
+# retries and duplicate uploads skip the pipeline (least recently used evicted)
+PREDICTION_CACHE_SIZE = 512
+prediction_cache: "OrderedDict[bytes, dict]" = OrderedDict()
+
+
+def get_cached_prediction(key: bytes):
+    """Return the cached response body for an upload hash, or None."""
+    body = prediction_cache.get(key)
+    if body is not None:
+        prediction_cache.move_to_end(key)
+    return body
+
+
+def cache_prediction(key: bytes, body: dict):
+    """Store a successful response body, evicting the least recently used entry."""
+    prediction_cache[key] = body
+    prediction_cache.move_to_end(key)
+    if len(prediction_cache) > PREDICTION_CACHE_SIZE:
+        prediction_cache.popitem(last=False)
+
+
+# Worker threads for decoding, eye detection and feature extraction, so
+# CPU-bound work does not block the event loop
+cpu_pool = None
+
+
+def cpu_pool_size() -> int:
+    """Threads per worker process: the cores divided among WEB_CONCURRENCY uvicorn workers."""
+    workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def fuse_scaler_into_ridge():
+    """
+    Fold the StandardScaler into the Ridge weights.
+
+    ridge(scaler(x)) = ((x - mean) / scale) @ coef + intercept
+                     = x @ (coef / scale) + (intercept - mean @ (coef / scale))
+    """
+    global fused_weights, fused_bias
+
+    coef = np.asarray(ridge_model.coef_, dtype=np.float64).ravel()
+    mean = scaler.mean_ if scaler.mean_ is not None else 0.0
+    scale = scaler.scale_ if scaler.scale_ is not None else 1.0
+
+    weights = coef / scale
+    fused_weights = weights.astype(np.float32)
+    fused_bias = np.float32(float(np.ravel(ridge_model.intercept_)[0]) - np.dot(mean, weights))
+
+
+def ridge_predict(features: np.ndarray) -> np.ndarray:
+    """Raw Ridge estimates for an (N, 46) feature matrix, equivalent to ridge_model.predict(scaler.transform(features))."""
+    return features @ fused_weights + fused_bias
+
 
 def load_models():
     """Load trained models and initialize eye detector."""
@@ -74,6 +143,9 @@ def load_models():
             scaler = pickle.load(f)
         print(f"✓ Scaler loaded: {SCALER_PATH}")
 
+        # Precompute the scaler + Ridge fused weights used for inference
+        fuse_scaler_into_ridge()
+
         # Initialize eye detector
         eye_detector = EyeDetector()
         print(f"✓ Eye detector initialized")
@@ -98,6 +170,15 @@ async def startup_event():
     print("="*70)
     success = load_models()
     if success:
+        global cpu_pool
+        # The pool already runs one image per core, so OpenCV's own
+        # parallel_for threads would only oversubscribe the CPUs
+        cpu_pool = ThreadPoolExecutor(
+            max_workers=cpu_pool_size(),
+            thread_name_prefix="hemolens-cpu",
+            initializer=cv2.setNumThreads,
+            initargs=(1,)
+        )
         print("\n✓ API Ready for hemoglobin predictions")
         print("  Model: Ridge Regression (46 features)")
         print("  Accuracy: R² = 0.6267, MAE = 0.96 g/dL")
@@ -106,6 +187,13 @@ async def startup_event():
     print("="*70 + "\n")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the CPU worker threads."""
+    if cpu_pool is not None:
+        cpu_pool.shutdown(wait=False)
+
+
 @app.get("/")
 async def root():
     """Root endpoint - API information."""
@@ -145,7 +233,7 @@ async def health_check():
 @app.get("/info")
 async def get_model_info():
     """Get model information."""
-    feature_names = list(FeatureExtractor.get_feature_names())
+    feature_names = list(FEATURE_NAMES)
 
     return {
         "model_name": "Ridge Regression Ensemble",
@@ -183,6 +271,67 @@ async def get_model_info():
     }
 
 
+async def read_upload(file: UploadFile):
+    """
+    Read an upload in chunks, hashing it as it streams in.
+
+    Raises HTTP 413 as soon as the upload exceeds MAX_UPLOAD_BYTES.
+
+    Returns:
+        (contents, 16-byte BLAKE2b digest of the contents)
+    """
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
+
+    contents = bytearray()
+    hasher = hashlib.blake2b(digest_size=16)
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        contents.extend(chunk)
+        if len(contents) > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Image too large")
+        hasher.update(chunk)
+
+    return contents, hasher.digest()
+
+
+def decode_image(contents: bytes):
+    """Decode uploaded image bytes to an RGB uint8 array, or None if they are not a supported image."""
+    if not contents:
+        return None
+    bgr = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+    if bgr is None:
+        return None
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+
+def extract_eye_features(image_array: np.ndarray):
+    """
+    Run eye detection and, if eyes are found, preprocessing and feature extraction.
+
+    Returns:
+        (1, 46) float32 model input row, or None if no eyes were detected
+    """
+    # Detection runs on its own downscaled copy; the model input is
+    # preprocessed from the full-resolution upload
+    if not eye_detector.detect_eyes(image_array):
+        return None
+
+    preprocessed = ImagePreprocessor.preprocess(
+        image_array,
+        resize=True,
+        denoise=True,
+        enhance_contrast=True
+    )
+
+    # Extract 46 features straight into the model input row
+    features_array = np.empty((1, len(FEATURE_NAMES)), dtype=np.float32)
+    FEATURE_EXTRACTOR.extract_all_features_vec(preprocessed, out=features_array[0])
+    return features_array
+
+
 @app.post("/predict")
 async def predict(file: UploadFile = File(...)):
     """Predict hemoglobin from single image with eye detection."""
@@ -200,12 +349,26 @@ async def predict(file: UploadFile = File(...)):
 
     try:
         # Read image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-        image_array = np.array(image)
+        contents, cache_key = await read_upload(file)
+
+        # Identical uploads get the cached result
+        cached = get_cached_prediction(cache_key)
+        if cached is not None:
+            return {
+                **cached,
+                "processing_time_ms": int((time.time() - start_time) * 1000),
+                "filename": file.filename
+            }
+
+        loop = asyncio.get_running_loop()
+
+        image_array = await loop.run_in_executor(cpu_pool, decode_image, contents)
+        if image_array is None:
+            raise HTTPException(status_code=400, detail="Could not decode image")
 
-        # Detect eyes first
-        if not eye_detector.detect_eyes(image_array):
+        # Detect eyes, preprocess and extract the 46 features off the event loop
+        features_array = await loop.run_in_executor(cpu_pool, extract_eye_features, image_array)
+        if features_array is None:
             return {
                 "status": "no_eyes_detected",
                 "message": "❌ No eyes detected in image. Please provide a clear image of your eye.",
@@ -215,28 +378,8 @@ async def predict(file: UploadFile = File(...)):
                 "filename": file.filename
             }
 
-        # Preprocess
-        preprocessed = ImagePreprocessor.preprocess(
-            image_array,
-            resize=True,
-            normalize=False,
-            denoise=True,
-            enhance_contrast=True
-        )
-
-        # Extract 46 features
-        feature_extractor = FeatureExtractor()
-        features_dict = feature_extractor.extract_all_features(preprocessed)
-
-        # Convert to array (maintaining order)
-        feature_names = feature_extractor.get_feature_names()
-        features_array = np.array([[features_dict[name] for name in feature_names]])
-
-        # Scale features
-        features_scaled = scaler.transform(features_array)
-
-        # Predict with Ridge model
-        hemoglobin_estimate = ridge_model.predict(features_scaled)[0]
+        # Scale and predict with Ridge model
+        hemoglobin_estimate = ridge_predict(features_array)[0]
 
         # Clamp to physiological range
         hemoglobin_estimate = np.clip(hemoglobin_estimate, 6.0, 18.0)
@@ -244,19 +387,27 @@ async def predict(file: UploadFile = File(...)):
         # Get health status
         health_status = get_hemoglobin_status(hemoglobin_estimate)
 
-        processing_time_ms = int((time.time() - start_time) * 1000)
-
-        return {
+        result = {
             "status": "success",
             "hemoglobin_estimate": float(hemoglobin_estimate),
             "unit": "g/dL",
             "health_status": health_status["status"],
             "health_message": health_status["message"],
             "health_color": health_status["color"],
+        }
+        cache_prediction(cache_key, result)
+
+        processing_time_ms = int((time.time() - start_time) * 1000)
+
+        return {
+            **result,
             "processing_time_ms": processing_time_ms,
             "filename": file.filename
         }
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -264,6 +415,22 @@ async def predict(file: UploadFile = File(...)):
         )
 
 
+def extract_upload_features(contents: bytes) -> np.ndarray:
+    """Decode, preprocess and extract the 46 features of one uploaded image as a (46,) float32 row."""
+    image_array = decode_image(contents)
+    if image_array is None:
+        raise ValueError("Could not decode image")
+
+    preprocessed = ImagePreprocessor.preprocess(
+        image_array,
+        resize=True,
+        denoise=True,
+        enhance_contrast=True
+    )
+
+    return FEATURE_EXTRACTOR.extract_all_features_vec(preprocessed)
+
+
 @app.post("/predict/batch")
 async def predict_batch(files: list[UploadFile] = File(...)):
     """Batch prediction from multiple images."""
@@ -274,45 +441,40 @@ async def predict_batch(files: list[UploadFile] = File(...)):
             detail="Models not loaded"
         )
 
-    results = []
-    feature_extractor = FeatureExtractor()
-    feature_names = feature_extractor.get_feature_names()
-
-    for file in files:
-        try:
-            # Read and preprocess
-            contents = await file.read()
-            image = Image.open(io.BytesIO(contents)).convert("RGB")
-            image_array = np.array(image)
-
-            preprocessed = ImagePreprocessor.preprocess(
-                image_array,
-                resize=True,
-                normalize=False,
-                denoise=True,
-                enhance_contrast=True
-            )
-
-            # Extract features
-            features_dict = feature_extractor.extract_all_features(preprocessed)
-            features_array = np.array([[features_dict[name] for name in feature_names]])
-
-            # Scale and predict
-            features_scaled = scaler.transform(features_array)
-            hemoglobin = float(np.clip(ridge_model.predict(features_scaled)[0], 6.0, 18.0))
+    # Read all uploads concurrently, then decode and extract features in
+    # worker threads so the event loop stays free for other requests
+    loop = asyncio.get_running_loop()
+
+    async def process_file(file: UploadFile) -> np.ndarray:
+        contents, _ = await read_upload(file)
+        return await loop.run_in_executor(cpu_pool, extract_upload_features, contents)
 
+    feature_rows = await asyncio.gather(
+        *(process_file(file) for file in files),
+        return_exceptions=True
+    )
+
+    # Score every successfully processed image in one call
+    ok_rows = [row for row in feature_rows if not isinstance(row, Exception)]
+    estimates = []
+    if ok_rows:
+        estimates = np.clip(ridge_predict(np.vstack(ok_rows)), 6.0, 18.0).tolist()
+
+    results = []
+    estimates_iter = iter(estimates)
+    for file, row in zip(files, feature_rows):
+        if isinstance(row, Exception):
             results.append({
                 "filename": file.filename,
-                "status": "success",
-                "hemoglobin_estimate": hemoglobin,
-                "unit": "g/dL"
+                "status": "error",
+                "error": row.detail if isinstance(row, HTTPException) else str(row)
             })
-
-        except Exception as e:
+        else:
             results.append({
                 "filename": file.filename,
-                "status": "error",
-                "error": str(e)
+                "status": "success",
+                "hemoglobin_estimate": next(estimates_iter),
+                "unit": "g/dL"
             })
 
     return {
@@ -350,9 +512,18 @@ async def models_status():
 
 if __name__ == "__main__":
     import uvicorn
+    workers = int(os.environ.get("WEB_CONCURRENCY", max(2, (os.cpu_count() or 1) // 2)))
+    # Worker processes read this to size their CPU thread pools
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+    # Multiple worker processes need the app as an import string; "auto"
+    # picks uvloop/httptools when installed and falls back otherwise
     uvicorn.run(
-        app,
+        "app:app",
         host="0.0.0.0",
         port=8000,
+        loop="auto",
+        http="auto",
+        workers=workers,
         log_level="info"
     )
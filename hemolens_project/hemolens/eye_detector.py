@@ -3,21 +3,59 @@ Eye Detection Module for HemoLens
 Uses Haar Cascade to detect eyes in images
 """
 
+import threading
 import cv2
 import numpy as np
 from pathlib import Path
 
+from preprocessing import ImagePreprocessor
+
+
+# Longest image side used for cascade detection
+DETECTION_MAX_SIDE = 480
+
 
 class EyeDetector:
     """Detect eyes in images using Haar Cascade."""
 
     def __init__(self):
         """Initialize eye cascade classifier."""
-        cascade_path = cv2.data.haarcascades + 'haarcascade_eye.xml'
-        self.eye_cascade = cv2.CascadeClassifier(cascade_path)
+        self.eye_cascade_path = cv2.data.haarcascades + 'haarcascade_eye.xml'
+        self.face_cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+
+        # detectMultiScale is not thread-safe, so each thread loads its own cascades
+        self._local = threading.local()
+        self._load_cascades()
+
+    def _load_cascades(self):
+        """Load the cascades for the calling thread."""
+        self._local.eye_cascade = cv2.CascadeClassifier(self.eye_cascade_path)
+        self._local.face_cascade = cv2.CascadeClassifier(self.face_cascade_path)
+
+    @property
+    def eye_cascade(self) -> "cv2.CascadeClassifier":
+        """Eye cascade for the calling thread."""
+        if not hasattr(self._local, "eye_cascade"):
+            self._load_cascades()
+        return self._local.eye_cascade
+
+    @property
+    def face_cascade(self) -> "cv2.CascadeClassifier":
+        """Face cascade for the calling thread."""
+        if not hasattr(self._local, "face_cascade"):
+            self._load_cascades()
+        return self._local.face_cascade
+
+    @staticmethod
+    def _to_gray(image: np.ndarray) -> np.ndarray:
+        """Convert an RGB image to grayscale (grayscale input is passed through)."""
+        if len(image.shape) == 3:
+            return cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_RGB2GRAY)
+        return image.astype(np.uint8)
 
-        face_cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        self.face_cascade = cv2.CascadeClassifier(face_cascade_path)
+    def _detection_gray(self, image: np.ndarray) -> np.ndarray:
+        """Downscaled grayscale image used for cascade detection."""
+        return self._to_gray(ImagePreprocessor.downscale(image, DETECTION_MAX_SIDE))
 
     def detect_eyes(self, image: np.ndarray) -> bool:
         """
@@ -29,19 +67,15 @@ class EyeDetector:
         Returns:
             True if eyes detected, False otherwise
         """
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_RGB2GRAY)
-        else:
-            gray = image.astype(np.uint8)
-
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        gray = clahe.apply(gray)
+        return self._find_eyes(self._detection_gray(image))
 
+    def _find_eyes(self, gray: np.ndarray) -> bool:
+        """Run the face cascade, then look for two eyes inside any detected face."""
         faces = self.face_cascade.detectMultiScale(
             gray,
-            scaleFactor=1.05,
-            minNeighbors=7,
-            minSize=(50, 50)
+            scaleFactor=1.1,
+            minNeighbors=5,
+            minSize=(40, 40)
         )
 
         if len(faces) == 0:
@@ -51,9 +85,9 @@ class EyeDetector:
             roi_gray = gray[y:y + h, x:x + w]
             eyes = self.eye_cascade.detectMultiScale(
                 roi_gray,
-                scaleFactor=1.05,
+                scaleFactor=1.1,
                 minNeighbors=8,
-                minSize=(20, 20)
+                minSize=(15, 15)
             )
 
             if len(eyes) >= 2:
@@ -72,10 +106,7 @@ class EyeDetector:
         Returns:
             Quality score (0-1)
         """
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_RGB2GRAY)
-        else:
-            gray = image.astype(np.uint8)
+        gray = self._detection_gray(image)
 
         faces = self.face_cascade.detectMultiScale(
             gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)
@@ -1,11 +1,59 @@
 import numpy as np
 import cv2
-from typing import Dict, Tuple
-from scipy import stats
+from typing import Dict, Optional, Tuple
+from scipy.special import xlogy
+
+
+# Model input order of the 46 features
+FEATURE_NAMES = (
+    "R_mean", "G_mean", "B_mean", "RG_ratio",
+    "L_mean", "a_mean", "b_mean", "L_std", "a_std", "b_std",
+    "H_mean", "S_mean", "V_mean", "H_std", "S_std", "V_std",
+    "Y_mean", "Cr_mean", "Cb_mean",
+    "R_std", "R_q25", "R_q75", "R_skewness",
+    "G_std", "G_q25", "G_q75", "G_skewness",
+    "B_std", "B_q25", "B_q75", "B_skewness",
+    "edge_mean", "edge_std", "edge_max", "edge_density",
+    "contrast_rms", "brightness", "dynamic_range",
+    "hist_entropy", "hist_energy", "hist_mean", "hist_std",
+    "hist_skewness", "hist_kurtosis", "hist_uniformity", "hist_peak"
+)
+
+_FEATURE_INDEX = {name: i for i, name in enumerate(FEATURE_NAMES)}
+
+_HIST_BINS = np.arange(256, dtype=np.float32)
+_LEVELS = np.arange(256, dtype=np.float64)
+
+
+def _histogram_percentile(cdf: np.ndarray, q: float) -> float:
+    """
+    Percentile of uint8 data from its cumulative 256-bin histogram.
+
+    Matches np.percentile's default linear interpolation between the two
+    order statistics around (n - 1) * q / 100.
+    """
+    n = int(cdf[-1])
+    position = (n - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, n - 1)
+
+    # The k-th smallest value (0-based) is the first level whose count exceeds k
+    lower_value, upper_value = np.searchsorted(cdf, [lower, upper], side="right")
+    return lower_value + (position - lower) * (upper_value - lower_value)
 
 
 class FeatureExtractor:
-    """Extract 46 advanced color, statistical, and texture features from palpebral conjunctiva images."""
+    """Extract 46 advanced color, statistical, and texture features from palpebral conjunctiva images.
+
+    Images are expected as uint8 RGB arrays, as returned by ImagePreprocessor.preprocess.
+    """
+
+    @staticmethod
+    def to_gray(image: np.ndarray) -> np.ndarray:
+        """Convert a uint8 RGB image to grayscale (grayscale input is passed through)."""
+        if len(image.shape) == 3:
+            return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        return image
 
     @staticmethod
     def extract_rgb_features(image: np.ndarray) -> Dict[str, float]:
@@ -26,53 +74,62 @@ class FeatureExtractor:
         }
 
     @staticmethod
-    def extract_lab_features(image: np.ndarray) -> Dict[str, float]:
-        """Extract LAB color space features (6 features)."""
+    def extract_lab_features(image: np.ndarray, lab: Optional[np.ndarray] = None) -> Dict[str, float]:
+        """Extract LAB color space features (6 features). Pass `lab` to reuse a converted image."""
         if len(image.shape) != 3 or image.shape[2] != 3:
             return {"L_mean": 0, "a_mean": 0, "b_mean": 0,
                    "L_std": 0, "a_std": 0, "b_std": 0}
 
-        lab = cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_RGB2LAB)
+        if lab is None:
+            lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
+
+        mean, std = cv2.meanStdDev(lab)
 
         return {
-            "L_mean": np.mean(lab[:, :, 0]),
-            "a_mean": np.mean(lab[:, :, 1]),
-            "b_mean": np.mean(lab[:, :, 2]),
-            "L_std": np.std(lab[:, :, 0]),
-            "a_std": np.std(lab[:, :, 1]),
-            "b_std": np.std(lab[:, :, 2]),
+            "L_mean": mean[0, 0],
+            "a_mean": mean[1, 0],
+            "b_mean": mean[2, 0],
+            "L_std": std[0, 0],
+            "a_std": std[1, 0],
+            "b_std": std[2, 0],
         }
 
     @staticmethod
-    def extract_hsv_features(image: np.ndarray) -> Dict[str, float]:
-        """Extract HSV color space features (6 features)."""
+    def extract_hsv_features(image: np.ndarray, hsv: Optional[np.ndarray] = None) -> Dict[str, float]:
+        """Extract HSV color space features (6 features). Pass `hsv` to reuse a converted image."""
         if len(image.shape) != 3 or image.shape[2] != 3:
             return {"H_mean": 0, "S_mean": 0, "V_mean": 0,
                    "H_std": 0, "S_std": 0, "V_std": 0}
 
-        hsv = cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_RGB2HSV)
+        if hsv is None:
+            hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+
+        mean, std = cv2.meanStdDev(hsv)
 
         return {
-            "H_mean": np.mean(hsv[:, :, 0]),
-            "S_mean": np.mean(hsv[:, :, 1]),
-            "V_mean": np.mean(hsv[:, :, 2]),
-            "H_std": np.std(hsv[:, :, 0]),
-            "S_std": np.std(hsv[:, :, 1]),
-            "V_std": np.std(hsv[:, :, 2]),
+            "H_mean": mean[0, 0],
+            "S_mean": mean[1, 0],
+            "V_mean": mean[2, 0],
+            "H_std": std[0, 0],
+            "S_std": std[1, 0],
+            "V_std": std[2, 0],
         }
 
     @staticmethod
-    def extract_ycrcb_features(image: np.ndarray) -> Dict[str, float]:
+    def extract_ycrcb_features(image: np.ndarray, ycrcb: Optional[np.ndarray] = None) -> Dict[str, float]:
         """Extract YCrCb color space features (3 features) - useful for skin tone."""
         if len(image.shape) != 3 or image.shape[2] != 3:
             return {"Y_mean": 0, "Cr_mean": 0, "Cb_mean": 0}
 
-        ycrcb = cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_RGB2YCrCb)
+        if ycrcb is None:
+            ycrcb = cv2.cvtColor(image, cv2.COLOR_RGB2YCrCb)
+
+        mean = cv2.mean(ycrcb)
 
         return {
-            "Y_mean": np.mean(ycrcb[:, :, 0]),
-            "Cr_mean": np.mean(ycrcb[:, :, 1]),
-            "Cb_mean": np.mean(ycrcb[:, :, 2]),
+            "Y_mean": mean[0],
+            "Cr_mean": mean[1],
+            "Cb_mean": mean[2],
         }
 
     @staticmethod
@@ -81,73 +138,111 @@ class FeatureExtractor:
         features = {}
 
         if len(image.shape) == 3:
+            # uint8 channels are fully described by their 256-bin histograms, so
+            # moments and percentiles come out exactly without sorting pixels
+            counts = np.stack([
+                cv2.calcHist([image], [i], None, [256], [0, 256]).ravel()
+                for i in range(3)
+            ]).astype(np.float64)
+            n = counts[0].sum()
+
+            mean = counts @ _LEVELS / n
+            centered = _LEVELS - mean[:, None]
+            centered_sq = centered * centered
+            m2 = (counts * centered_sq).sum(axis=1) / n
+            m3 = (counts * centered_sq * centered).sum(axis=1) / n
+
+            std = np.sqrt(m2)
+            # Population skewness, same definition as scipy.stats.skew(bias=True)
+            skewness = m3 / m2 ** 1.5
+
+            cdf = np.cumsum(counts, axis=1)
+            q25 = [_histogram_percentile(c, 25) for c in cdf]
+            q75 = [_histogram_percentile(c, 75) for c in cdf]
+
             for i, channel_name in enumerate(['R', 'G', 'B']):
-                channel = image[:, :, i].flatten()
-                features[f"{channel_name}_std"] = np.std(channel)
-                features[f"{channel_name}_q25"] = np.percentile(channel, 25)
-                features[f"{channel_name}_q75"] = np.percentile(channel, 75)
-                features[f"{channel_name}_skewness"] = stats.skew(channel)
+                features[f"{channel_name}_std"] = std[i]
+                features[f"{channel_name}_q25"] = q25[i]
+                features[f"{channel_name}_q75"] = q75[i]
+                features[f"{channel_name}_skewness"] = skewness[i]
 
         return features
 
     @staticmethod
-    def extract_edge_features(image: np.ndarray) -> Dict[str, float]:
+    def extract_edge_features(image: np.ndarray, gray: Optional[np.ndarray] = None) -> Dict[str, float]:
         """Extract edge-based texture features (4 features)."""
         features = {}
 
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_RGB2GRAY)
-        else:
-            gray = image.astype(np.uint8)
+        if gray is None:
+            gray = FeatureExtractor.to_gray(image)
+
+        # 3x3 Sobel on uint8 input fits in int16 (|g| <= 1020), so the 16-bit
+        # gradients are exact. The magnitude uses np.hypot in float32 because
+        # cv2.magnitude rounds |g| == 30 up, which shifts edge_density.
+        sobelx = cv2.Sobel(gray, cv2.CV_16S, 1, 0, ksize=3)
+        sobely = cv2.Sobel(gray, cv2.CV_16S, 0, 1, ksize=3)
+        edges = np.hypot(sobelx.astype(np.float32), sobely.astype(np.float32))
 
-        sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-        edges = np.hypot(sobelx, sobely)
+        mean, std = cv2.meanStdDev(edges)
+        _, edge_max, _, _ = cv2.minMaxLoc(edges)
 
-        features["edge_mean"] = np.mean(edges)
-        features["edge_std"] = np.std(edges)
-        features["edge_max"] = np.max(edges)
-        features["edge_density"] = np.sum(edges > 30) / edges.size
+        features["edge_mean"] = mean[0, 0]
+        features["edge_std"] = std[0, 0]
+        features["edge_max"] = edge_max
+        features["edge_density"] = cv2.countNonZero(cv2.compare(edges, 30, cv2.CMP_GT)) / edges.size
 
         return features
 
     @staticmethod
-    def extract_contrast_features(image: np.ndarray) -> Dict[str, float]:
+    def extract_contrast_features(image: np.ndarray, gray: Optional[np.ndarray] = None) -> Dict[str, float]:
         """Extract contrast and brightness features (3 features)."""
         features = {}
 
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_RGB2GRAY)
-        else:
-            gray = image.astype(np.uint8)
+        if gray is None:
+            gray = FeatureExtractor.to_gray(image)
+
+        # RMS contrast about the mean is the population std
+        mean, std = cv2.meanStdDev(gray)
+        gray_min, gray_max, _, _ = cv2.minMaxLoc(gray)
 
-        features["contrast_rms"] = np.sqrt(np.mean((gray - np.mean(gray))**2))
-        features["brightness"] = np.mean(gray)
-        features["dynamic_range"] = np.max(gray) - np.min(gray)
+        features["contrast_rms"] = std[0, 0]
+        features["brightness"] = mean[0, 0]
+        features["dynamic_range"] = gray_max - gray_min
 
         return features
 
     @staticmethod
-    def extract_histogram_features(image: np.ndarray) -> Dict[str, float]:
+    def extract_histogram_features(image: np.ndarray, gray: Optional[np.ndarray] = None) -> Dict[str, float]:
         """Extract histogram-based features (8 features)."""
         features = {}
 
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_RGB2GRAY)
-        else:
-            gray = image.astype(np.uint8)
-
-        hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
-        hist = hist.flatten() / hist.sum()
-
-        features["hist_entropy"] = -np.sum(hist[hist > 0] * np.log2(hist[hist > 0]))
-        features["hist_energy"] = np.sum(hist ** 2)
-        features["hist_mean"] = np.mean(np.arange(256) * hist)
-        features["hist_std"] = np.std(np.arange(256) * hist)
-        features["hist_skewness"] = stats.skew(np.arange(256) * hist)
-        features["hist_kurtosis"] = stats.kurtosis(np.arange(256) * hist)
-        features["hist_uniformity"] = np.sum(hist**2)
-        features["hist_peak"] = np.max(hist)
+        if gray is None:
+            gray = FeatureExtractor.to_gray(image)
+
+        # Normalize the 256-bin histogram to a PMF in place
+        hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+        cv2.normalize(hist, hist, 1, 0, cv2.NORM_L1)
+
+        # Moments of the bin-weighted histogram (bins * p), the definition the
+        # models were trained on, reduced with dot products over one centered array
+        n = hist.size
+        weighted = _HIST_BINS * hist
+        mean = weighted.sum() / n
+        centered = weighted - mean
+        centered_sq = centered * centered
+        m2 = centered_sq.sum() / n
+        m3 = np.dot(centered_sq, centered) / n
+        m4 = np.dot(centered_sq, centered_sq) / n
+        energy = np.dot(hist, hist)
+
+        features["hist_entropy"] = -xlogy(hist, hist).sum() / np.log(2)
+        features["hist_energy"] = energy
+        features["hist_mean"] = mean
+        features["hist_std"] = np.sqrt(m2)
+        features["hist_skewness"] = m3 / m2 ** 1.5
+        features["hist_kurtosis"] = m4 / m2 ** 2 - 3.0
+        features["hist_uniformity"] = energy
+        features["hist_peak"] = hist.max()
 
         return features
 
@@ -168,17 +263,59 @@ class FeatureExtractor:
         """
         features = {}
 
-        features.update(FeatureExtractor.extract_rgb_features(image))
-        features.update(FeatureExtractor.extract_lab_features(image))
-        features.update(FeatureExtractor.extract_hsv_features(image))
-        features.update(FeatureExtractor.extract_ycrcb_features(image))
-        features.update(FeatureExtractor.extract_statistical_features(image))
-        features.update(FeatureExtractor.extract_edge_features(image))
-        features.update(FeatureExtractor.extract_contrast_features(image))
-        features.update(FeatureExtractor.extract_histogram_features(image))
+        for group in FeatureExtractor._feature_groups(image):
+            features.update(group)
 
         return features
 
+    @staticmethod
+    def extract_all_features_vec(image: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Extract all 46 features into a float32 vector ordered as get_feature_names().
+
+        Args:
+            image: uint8 RGB image (H x W x 3)
+            out: Optional preallocated (46,) float32 array to write into
+
+        Returns:
+            Feature vector (46,)
+        """
+        if len(image.shape) != 3 or image.shape[2] != 3:
+            raise ValueError("Expected an RGB image of shape (H, W, 3)")
+
+        if out is None:
+            out = np.empty(len(FEATURE_NAMES), dtype=np.float32)
+
+        written = 0
+        for group in FeatureExtractor._feature_groups(image):
+            for name, value in group.items():
+                out[_FEATURE_INDEX[name]] = value
+            written += len(group)
+
+        if written != len(FEATURE_NAMES):
+            raise ValueError(f"Extracted {written} features, expected {len(FEATURE_NAMES)}")
+
+        return out
+
+    @staticmethod
+    def _feature_groups(image: np.ndarray):
+        """Yield the 8 feature groups in model order, converting each colorspace once."""
+        lab = hsv = ycrcb = None
+        if len(image.shape) == 3 and image.shape[2] == 3:
+            lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
+            hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+            ycrcb = cv2.cvtColor(image, cv2.COLOR_RGB2YCrCb)
+        gray = FeatureExtractor.to_gray(image)
+
+        yield FeatureExtractor.extract_rgb_features(image)
+        yield FeatureExtractor.extract_lab_features(image, lab)
+        yield FeatureExtractor.extract_hsv_features(image, hsv)
+        yield FeatureExtractor.extract_ycrcb_features(image, ycrcb)
+        yield FeatureExtractor.extract_statistical_features(image)
+        yield FeatureExtractor.extract_edge_features(image, gray)
+        yield FeatureExtractor.extract_contrast_features(image, gray)
+        yield FeatureExtractor.extract_histogram_features(image, gray)
+
     @staticmethod
     def extract_features_batch(images: list) -> Tuple[np.ndarray, list]:
         """
@@ -202,18 +339,6 @@ class FeatureExtractor:
         return np.array(all_features), feature_names
 
     @staticmethod
-    def get_feature_names() -> list:
-        """Get names of all 46 features."""
-        return [
-            "R_mean", "G_mean", "B_mean", "RG_ratio",
-            "L_mean", "a_mean", "b_mean", "L_std", "a_std", "b_std",
-            "H_mean", "S_mean", "V_mean", "H_std", "S_std", "V_std",
-            "Y_mean", "Cr_mean", "Cb_mean",
-            "R_std", "R_q25", "R_q75", "R_skewness",
-            "G_std", "G_q25", "G_q75", "G_skewness",
-            "B_std", "B_q25", "B_q75", "B_skewness",
-            "edge_mean", "edge_std", "edge_max", "edge_density",
-            "contrast_rms", "brightness", "dynamic_range",
-            "hist_entropy", "hist_energy", "hist_mean", "hist_std",
-            "hist_skewness", "hist_kurtosis", "hist_uniformity", "hist_peak"
-        ]
+    def get_feature_names() -> Tuple[str, ...]:
+        """Get names of all 46 features (shared tuple, in model input order)."""
+        return FEATURE_NAMES